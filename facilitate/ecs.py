@@ -1,14 +1,23 @@
+import os
+import shlex
 import subprocess
-import sys
+from concurrent.futures import ThreadPoolExecutor
 from itertools import chain
 
-import boto3
 import click
-from halo import Halo
-from PyInquirer import prompt
 
-ecs_client = boto3.client("ecs")
-ec2_client = boto3.client("ec2")
+# ECS list_tasks and describe_* calls handle at most 100 items per request
+ECS_MAX_RESULTS = 100
+
+_executor = ThreadPoolExecutor(max_workers=8)
+
+SSH_COMMAND = (
+    "ssh",
+    "-o",
+    "ControlMaster=auto",
+    "-o",
+    "ControlPath=~/.ssh/cm-%r@%h:%p",
+)
 
 DEFAULT_PRELOADER_STYLES = {
     "text_color": "white",
@@ -22,151 +31,258 @@ def ecs():
 
 
 @ecs.command()
+@click.option("--region", help="AWS region to query; defaults to the boto3 configuration chain.")
 @click.option("--cluster")
 @click.option("--service")
 @click.option("--user", default="ec2-user")
 @click.option(
     "-i", "--identity-file", default="~/.ssh/id_rsa",
 )
+@click.option(
+    "--persist",
+    default=60,
+    type=click.IntRange(min=0),
+    help="Seconds to keep the SSH connection open for reuse through a ~/.ssh/cm-* socket "
+    "(0 closes it with the session).",
+)
+@click.option(
+    "--limit", type=click.IntRange(min=1), help="Look up at most this many running tasks.",
+)
+@click.option(
+    "-v", "--verbose", is_flag=True, help="List the looked-up task ARNs, instance IDs and IPs.",
+)
+@click.option("--instance-ip", help="Connect to this instance instead of looking it up in ECS.")
+@click.option("-y", "--yes", is_flag=True, help="Do not ask for confirmation.")
 @click.argument("container", nargs=1)
 @click.argument("command", nargs=-1)
-def exec(cluster, service, user, identity_file, container, command):
+def exec(
+    region,
+    cluster,
+    service,
+    user,
+    identity_file,
+    persist,
+    limit,
+    verbose,
+    instance_ip,
+    yes,
+    container,
+    command,
+):
     """
     A script to facilitate executing commands in Amazon Elastic Container Service containers
     https://github.com/mkalmykov/facilitate
     """
-    normalized_command = " ".join(command)
+    # a single argument is a whole command line, e.g. "ls -la" passed as one string
+    if len(command) == 1:
+        command = shlex.split(command[0])
+    normalized_command = shlex.join(command)
+
+    if instance_ip is None:
+        container_instance_ips = _lookup_container_instance_ips(
+            verbose, region, cluster, service, container, limit
+        )
+        instance_ip = _ask_target_instance_ip(container_instance_ips)
 
-    container_task_arns = _get_container_task_arns(cluster, service)
-    container_instance_arns = _get_container_instance_arns(cluster, container_task_arns, container)
-    container_instance_ids = _get_container_instance_ids(cluster, container_instance_arns)
-    container_instance_ips = _get_container_instance_ips(container_instance_ids)
-    target_instance_ip = _ask_target_instance_ip(container_instance_ips)
+    if not yes:
+        _ask_should_exec(normalized_command, container, instance_ip)
 
-    _ask_should_exec(normalized_command, container, target_instance_ip)
+    return _exec(identity_file, user, instance_ip, persist, container, normalized_command)
 
-    return _exec(identity_file, user, target_instance_ip, container, normalized_command)
 
+def _lookup_container_instance_ips(verbose, region, cluster, service, container, limit):
+    import boto3
+    from halo import Halo
 
-def _get_container_task_arns(cluster, service):
-    with Halo(
-        text="Obtaining ARNs of running ECS tasks with EC2 launch type", **DEFAULT_PRELOADER_STYLES,
-    ) as sp:
-        list_tasks_response = ecs_client.list_tasks(
-            cluster=cluster, serviceName=service, desiredStatus="RUNNING", launchType="EC2",
+    # both clients share one session so config and credentials are resolved once
+    session = boto3.session.Session(region_name=region)
+    ecs_client = session.client("ecs")
+    ec2_client = session.client("ec2")
+
+    # one spinner runs through all stages, each stage only changes its text
+    sp = Halo(**DEFAULT_PRELOADER_STYLES)
+    try:
+        container_task_arns = _get_container_task_arns(
+            sp, verbose, ecs_client, cluster, service, limit
+        )
+        container_instance_arns = _get_container_instance_arns(
+            sp, verbose, ecs_client, cluster, container_task_arns, container
+        )
+        container_instance_ids = _get_container_instance_ids(
+            sp, verbose, ecs_client, cluster, container_instance_arns
+        )
+        container_instance_ips = _get_container_instance_ips(
+            sp, verbose, ec2_client, container_instance_ids
         )
-        container_task_arns = list_tasks_response["taskArns"]
 
-        sp.succeed()
+        if not verbose:
+            sp.succeed()
+    finally:
+        sp.stop()
+
+    return container_instance_ips
+
+
+def _get_container_task_arns(sp, verbose, ecs_client, cluster, service, limit):
+    sp.start("Obtaining ARNs of running ECS tasks with EC2 launch type")
+
+    list_tasks_pages = ecs_client.get_paginator("list_tasks").paginate(
+        cluster=cluster,
+        serviceName=service,
+        desiredStatus="RUNNING",
+        launchType="EC2",
+        PaginationConfig={
+            "PageSize": min(limit or ECS_MAX_RESULTS, ECS_MAX_RESULTS),
+            "MaxItems": limit,
+        },
+    )
+    container_task_arns = [arn for page in list_tasks_pages for arn in page["taskArns"]]
 
     if len(container_task_arns) == 0:
-        click.echo(click.style("\nCould not find target tasks. Exiting!", fg="red", bold=True))
-        sys.exit(1)
+        raise click.ClickException("Could not find target tasks.")
 
-    for task_arn in container_task_arns:
-        click.echo(click.style(f"  - {task_arn}", fg="green"))
+    _complete_stage(sp, verbose, container_task_arns)
 
     return container_task_arns
 
 
-def _get_container_instance_arns(cluster, task_arns, container):
-    with Halo(text="Obtaining container instance ARNs", **DEFAULT_PRELOADER_STYLES) as sp:
-        describe_tasks_response = ecs_client.describe_tasks(cluster=cluster, tasks=task_arns,)
-        tasks_with_target_container = [
-            t
-            for t in describe_tasks_response["tasks"]
-            if any(c for c in t["containers"] if c["name"] == container)
-        ]
-        container_instance_arns = [
-            task["containerInstanceArn"] for task in tasks_with_target_container
-        ]
+def _get_container_instance_arns(sp, verbose, ecs_client, cluster, task_arns, container):
+    sp.start("Obtaining container instance ARNs")
 
-        sp.succeed()
+    describe_tasks_responses = _executor.map(
+        lambda chunk: ecs_client.describe_tasks(cluster=cluster, tasks=chunk),
+        _chunks(task_arns, ECS_MAX_RESULTS),
+    )
+    tasks_with_target_container = [
+        t
+        for t in chain.from_iterable(r["tasks"] for r in describe_tasks_responses)
+        if any(c["name"] == container for c in t["containers"])
+    ]
+    # several tasks may be placed on the same container instance
+    container_instance_arns = list(
+        dict.fromkeys(task["containerInstanceArn"] for task in tasks_with_target_container)
+    )
 
-    for instance_arn in container_instance_arns:
-        click.echo(click.style(f"  - {instance_arn}", fg="green"))
+    if len(container_instance_arns) == 0:
+        raise click.ClickException(f'Could not find tasks running container "{container}".')
+
+    _complete_stage(sp, verbose, container_instance_arns)
 
     return container_instance_arns
 
 
-def _get_container_instance_ids(cluster, container_instance_arns):
-    with Halo(text="Obtaining container instance IDs", **DEFAULT_PRELOADER_STYLES) as sp:
-        describe_container_instances_response = ecs_client.describe_container_instances(
-            cluster=cluster, containerInstances=container_instance_arns,
+def _get_container_instance_ids(sp, verbose, ecs_client, cluster, container_instance_arns):
+    sp.start("Obtaining container instance IDs")
+
+    describe_container_instances_responses = _executor.map(
+        lambda chunk: ecs_client.describe_container_instances(
+            cluster=cluster, containerInstances=chunk
+        ),
+        _chunks(container_instance_arns, ECS_MAX_RESULTS),
+    )
+    container_instance_ids = [
+        container_instance["ec2InstanceId"]
+        for container_instance in chain.from_iterable(
+            r["containerInstances"] for r in describe_container_instances_responses
         )
-        container_instance_ids = [
-            container_instance["ec2InstanceId"]
-            for container_instance in describe_container_instances_response["containerInstances"]
-        ]
+    ]
 
-        sp.succeed()
+    # an empty InstanceIds list would make describe_instances list every instance in the region
+    if len(container_instance_ids) == 0:
+        raise click.ClickException("Could not find the container instances of the target tasks.")
 
-    for instance_id in container_instance_ids:
-        click.echo(click.style(f"  - {instance_id}", fg="green"))
+    _complete_stage(sp, verbose, container_instance_ids)
 
     return container_instance_ids
 
 
-def _get_container_instance_ips(container_instance_ids):
-    with Halo(text="Obtaining container instance IP addresses", **DEFAULT_PRELOADER_STYLES,) as sp:
-        describe_instances_response = ec2_client.describe_instances(
-            InstanceIds=container_instance_ids,
-        )
+def _get_container_instance_ips(sp, verbose, ec2_client, container_instance_ids):
+    sp.start("Obtaining container instance IP addresses")
 
-        instances = list(
-            chain(
-                *[
-                    reservation["Instances"]
-                    for reservation in describe_instances_response["Reservations"]
-                ]
-            )
-        )
-        container_instance_ips = [instance["PublicIpAddress"] for instance in instances]
-        sp.succeed()
+    describe_instances_pages = ec2_client.get_paginator("describe_instances").paginate(
+        InstanceIds=container_instance_ids
+    )
+
+    # instances without a public IP address cannot be reached over SSH
+    container_instance_ips = [
+        instance["PublicIpAddress"]
+        for page in describe_instances_pages
+        for reservation in page["Reservations"]
+        for instance in reservation["Instances"]
+        if "PublicIpAddress" in instance
+    ]
 
-    for instance_ip in container_instance_ips:
-        click.echo(click.style(f"  - {instance_ip}", fg="green"))
+    if len(container_instance_ips) == 0:
+        raise click.ClickException("None of the container instances has a public IP address.")
+
+    _complete_stage(sp, verbose, container_instance_ips)
 
     return container_instance_ips
 
 
+def _complete_stage(sp, verbose, items):
+    # verbose listings cannot be printed under a running spinner, so persist the stage and let
+    # the next stage's sp.start() restart it
+    if verbose:
+        sp.succeed()
+        _echo_items(items)
+
+
+def _echo_items(items):
+    if items:
+        click.echo("\n".join(click.style(f"  - {item}", fg="green") for item in items))
+
+
+def _chunks(seq, n):
+    for i in range(0, len(seq), n):
+        yield seq[i : i + n]
+
+
 def _ask_target_instance_ip(container_instance_ips):
-    target_instance_ip_answer = prompt(
-        [
-            {
-                "type": "list",
-                "name": "target_instance_ip",
-                "message": "Choose EC2 instance to connect to",
-                "choices": container_instance_ips,
-            }
-        ]
+    if len(container_instance_ips) == 1:
+        click.echo(f"Connecting to the only available instance {container_instance_ips[0]}")
+        return container_instance_ips[0]
+
+    click.echo("\n".join(f"  [{i}] {ip}" for i, ip in enumerate(container_instance_ips, start=1)))
+    target_instance_index = click.prompt(
+        "Choose EC2 instance to connect to",
+        type=click.IntRange(1, len(container_instance_ips)),
+        default=1,
     )
 
-    return target_instance_ip_answer["target_instance_ip"]
+    return container_instance_ips[target_instance_index - 1]
 
 
 def _ask_should_exec(command, container, instance_ip):
-    should_exec_answer = prompt(
-        [
-            {
-                "type": "confirm",
-                "message": f'You are about to execute "{command}" in the container "{container}" running on the instance "{instance_ip}". Do you want to continue?',
-                "name": "should_exec",
-                "default": True,
-            }
-        ]
+    should_exec = click.confirm(
+        f'You are about to execute "{command}" in the container "{container}" running on the instance "{instance_ip}". Do you want to continue?',
+        default=True,
     )
-    should_exec = should_exec_answer["should_exec"]
 
     if not should_exec:
         click.echo(click.style("\nOperation aborted. Exiting!", fg="red", bold=True))
-        sys.exit(0)
+        click.get_current_context().exit(0)
+
 
+def _exec(identity_file, user, instance_ip, persist, container, command):
+    container_filter = shlex.quote(f"name=-{container}-")
+    remote_command = (
+        "exec docker exec -it "
+        f'"$(docker container ls -q --latest -f status=running -f {container_filter})" '
+        f"{command}"
+    )
 
-def _exec(identity_file, user, instance_ip, container, command):
     return subprocess.call(
-        f"ssh -i {identity_file} {user}@{instance_ip} -t 'bash -c \"docker exec -it $(docker ps -q -f name='{container}' | head -n 1) {command}\"'",
-        shell=True,
+        [
+            *SSH_COMMAND,
+            "-o",
+            f"ControlPersist={persist}s" if persist else "ControlPersist=no",
+            "-i",
+            os.path.expanduser(identity_file),
+            "-t",
+            f"{user}@{instance_ip}",
+            remote_command,
+        ]
     )
 
 
@@ -0,0 +1,324 @@
+import boto3
+import halo
+import pytest
+from click.testing import CliRunner
+
+from facilitate import ecs
+
+TASK_ARN = "arn:aws:ecs:us-east-1:123456789012:task/default/1"
+CONTAINER_INSTANCE_ARN = "arn:aws:ecs:us-east-1:123456789012:container-instance/default/1"
+INSTANCE_ID = "i-0123456789abcdef0"
+
+
+class FakePaginator:
+    def __init__(self, pages):
+        self.pages = pages
+        self.paginate_calls = []
+
+    def paginate(self, **kwargs):
+        self.paginate_calls.append(kwargs)
+        return iter(self.pages)
+
+
+class FakeECSClient:
+    def __init__(self, tasks, registered=True, tasks_per_page=None):
+        self.tasks = tasks
+        self.registered = registered
+        self.describe_container_instances_calls = []
+        task_arns = [t["taskArn"] for t in tasks]
+        pages = list(ecs._chunks(task_arns, tasks_per_page or max(len(task_arns), 1))) or [[]]
+        self.list_tasks_paginator = FakePaginator([{"taskArns": page} for page in pages])
+
+    def get_paginator(self, operation_name):
+        assert operation_name == "list_tasks"
+        return self.list_tasks_paginator
+
+    def describe_tasks(self, cluster, tasks):
+        return {"tasks": [t for t in self.tasks if t["taskArn"] in tasks]}
+
+    def describe_container_instances(self, cluster, containerInstances):
+        self.describe_container_instances_calls.append(containerInstances)
+
+        if not self.registered:
+            return {
+                "containerInstances": [],
+                "failures": [{"arn": arn, "reason": "MISSING"} for arn in containerInstances],
+            }
+
+        return {
+            "containerInstances": [
+                {"containerInstanceArn": arn, "ec2InstanceId": INSTANCE_ID}
+                for arn in containerInstances
+            ]
+        }
+
+
+class FakeEC2Client:
+    def __init__(self, instances):
+        self.instances = instances
+        self.describe_instances_calls = []
+
+    def get_paginator(self, operation_name):
+        assert operation_name == "describe_instances"
+        return self
+
+    def paginate(self, InstanceIds):
+        self.describe_instances_calls.append(InstanceIds)
+        return iter([{"Reservations": [{"Instances": self.instances}]}])
+
+
+class FakeSpinner:
+    def __init__(self):
+        self.running = False
+        self.starts = 0
+
+    def start(self, text=None):
+        # like Halo, starting a running spinner only updates its text
+        if not self.running:
+            self.running = True
+            self.starts += 1
+
+    def stop(self):
+        self.running = False
+
+    def succeed(self, text=None):
+        self.stop()
+
+
+class FakeSession:
+    def __init__(self, ecs_client, ec2_client):
+        self.ecs_client = ecs_client
+        self.ec2_client = ec2_client
+
+    def client(self, service_name):
+        return {"ecs": self.ecs_client, "ec2": self.ec2_client}[service_name]
+
+
+def _task(container_name, task_arn=TASK_ARN):
+    return {
+        "taskArn": task_arn,
+        "containerInstanceArn": CONTAINER_INSTANCE_ARN,
+        "containers": [{"name": container_name}],
+    }
+
+
+@pytest.fixture
+def ssh_calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(ecs.subprocess, "call", lambda argv: calls.append(argv) or 0)
+    return calls
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    def _aws(tasks, instances, **ecs_client_kwargs):
+        session = FakeSession(FakeECSClient(tasks, **ecs_client_kwargs), FakeEC2Client(instances))
+        monkeypatch.setattr(boto3.session, "Session", lambda region_name=None: session)
+        return session
+
+    return _aws
+
+
+@pytest.fixture
+def no_aws(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("AWS should not be queried")
+
+    monkeypatch.setattr(boto3.session, "Session", fail)
+
+
+def test_chunks():
+    assert list(ecs._chunks(list(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(ecs._chunks([], 2)) == []
+
+
+def test_exec_no_tasks(aws, ssh_calls):
+    aws(tasks=[], instances=[])
+
+    result = CliRunner().invoke(ecs.ecs, ["exec", "-y", "web", "ls"])
+
+    assert result.exit_code == 1
+    assert "Could not find target tasks." in result.output
+    assert ssh_calls == []
+
+
+def test_exec_no_task_runs_container(aws, ssh_calls):
+    session = aws(tasks=[_task("worker")], instances=[{"PublicIpAddress": "10.0.0.1"}])
+
+    result = CliRunner().invoke(ecs.ecs, ["exec", "-y", "web", "ls"])
+
+    assert result.exit_code == 1
+    assert 'Could not find tasks running container "web".' in result.output
+    assert session.ec2_client.describe_instances_calls == []
+    assert ssh_calls == []
+
+
+def test_exec_container_instance_deregistered(aws, ssh_calls):
+    session = aws(
+        tasks=[_task("web")], instances=[{"PublicIpAddress": "10.0.0.1"}], registered=False
+    )
+
+    result = CliRunner().invoke(ecs.ecs, ["exec", "-y", "web", "ls"])
+
+    assert result.exit_code == 1
+    assert "Could not find the container instances of the target tasks." in result.output
+    assert session.ec2_client.describe_instances_calls == []
+    assert ssh_calls == []
+
+
+def test_exec_tasks_on_one_container_instance(aws, ssh_calls):
+    session = aws(
+        tasks=[_task("web", f"{TASK_ARN}-a"), _task("web", f"{TASK_ARN}-b")],
+        instances=[{"PublicIpAddress": "10.0.0.1"}],
+    )
+
+    result = CliRunner().invoke(ecs.ecs, ["exec", "-y", "web", "ls"])
+
+    assert result.exit_code == 0
+    assert session.ecs_client.describe_container_instances_calls == [[CONTAINER_INSTANCE_ARN]]
+    assert session.ec2_client.describe_instances_calls == [[INSTANCE_ID]]
+
+
+def test_exec_reads_every_list_tasks_page(aws, ssh_calls):
+    session = aws(
+        tasks=[_task("worker", f"{TASK_ARN}-worker"), _task("web")],
+        instances=[{"PublicIpAddress": "10.0.0.1"}],
+        tasks_per_page=1,
+    )
+
+    result = CliRunner().invoke(ecs.ecs, ["exec", "-y", "web", "ls"])
+
+    assert result.exit_code == 0
+    (paginate_kwargs,) = session.ecs_client.list_tasks_paginator.paginate_calls
+    assert paginate_kwargs["PaginationConfig"] == {"PageSize": 100, "MaxItems": None}
+    (argv,) = ssh_calls
+    assert "ec2-user@10.0.0.1" in argv
+
+
+def test_exec_limit(aws, ssh_calls):
+    session = aws(tasks=[_task("web")], instances=[{"PublicIpAddress": "10.0.0.1"}])
+
+    result = CliRunner().invoke(ecs.ecs, ["exec", "--limit", "1", "-y", "web", "ls"])
+
+    assert result.exit_code == 0
+    (paginate_kwargs,) = session.ecs_client.list_tasks_paginator.paginate_calls
+    assert paginate_kwargs["PaginationConfig"] == {"PageSize": 1, "MaxItems": 1}
+
+
+@pytest.mark.parametrize("verbose_args, listed", [([], False), (["-v"], True)])
+def test_exec_verbose(aws, ssh_calls, verbose_args, listed):
+    aws(tasks=[_task("web")], instances=[{"PublicIpAddress": "10.0.0.1"}])
+
+    result = CliRunner().invoke(ecs.ecs, ["exec", *verbose_args, "-y", "web", "ls"])
+
+    assert result.exit_code == 0
+    for item in [TASK_ARN, CONTAINER_INSTANCE_ARN, INSTANCE_ID, "10.0.0.1"]:
+        assert (f"  - {item}" in result.output) is listed
+
+
+def test_exec_choose_instance(aws, ssh_calls):
+    aws(
+        tasks=[_task("web")],
+        instances=[{"PublicIpAddress": "10.0.0.1"}, {"PublicIpAddress": "10.0.0.2"}],
+    )
+
+    result = CliRunner().invoke(ecs.ecs, ["exec", "-y", "web", "ls"], input="2\n")
+
+    assert result.exit_code == 0
+    assert "  [1] 10.0.0.1\n  [2] 10.0.0.2\n" in result.output
+    (argv,) = ssh_calls
+    assert "ec2-user@10.0.0.2" in argv
+
+
+def test_exec_single_instance_is_selected(aws, ssh_calls):
+    aws(tasks=[_task("web")], instances=[{"PublicIpAddress": "10.0.0.1"}])
+
+    result = CliRunner().invoke(ecs.ecs, ["exec", "-y", "web", "ls"])
+
+    assert result.exit_code == 0
+    assert "Connecting to the only available instance 10.0.0.1" in result.output
+    assert "Choose EC2 instance to connect to" not in result.output
+    (argv,) = ssh_calls
+    assert "ec2-user@10.0.0.1" in argv
+
+
+@pytest.mark.parametrize("verbose_args, starts", [([], 1), (["-v"], 4)])
+def test_exec_spinner_starts(monkeypatch, aws, ssh_calls, verbose_args, starts):
+    spinner = FakeSpinner()
+    monkeypatch.setattr(halo, "Halo", lambda **kwargs: spinner)
+    aws(tasks=[_task("web")], instances=[{"PublicIpAddress": "10.0.0.1"}])
+
+    result = CliRunner().invoke(ecs.ecs, ["exec", *verbose_args, "-y", "web", "ls"])
+
+    assert result.exit_code == 0
+    assert spinner.starts == starts
+    assert not spinner.running
+
+
+def test_exec_no_public_ip(aws, ssh_calls):
+    aws(tasks=[_task("web")], instances=[{"PrivateIpAddress": "172.16.0.1"}])
+
+    result = CliRunner().invoke(ecs.ecs, ["exec", "-y", "web", "ls"])
+
+    assert result.exit_code == 1
+    assert "None of the container instances has a public IP address." in result.output
+    assert ssh_calls == []
+
+
+def test_exec_declined(aws, ssh_calls):
+    aws(tasks=[_task("web")], instances=[{"PublicIpAddress": "10.0.0.1"}])
+
+    result = CliRunner().invoke(ecs.ecs, ["exec", "web", "ls"], input="n\n")
+
+    assert result.exit_code == 0
+    assert "Operation aborted. Exiting!" in result.output
+    assert ssh_calls == []
+
+
+def test_exec_instance_ip_skips_lookups(no_aws, ssh_calls):
+    result = CliRunner().invoke(
+        ecs.ecs,
+        ["exec", "--instance-ip", "10.0.0.1", "-y", "web", "--", "bash", "-c", "echo hi; id"],
+    )
+
+    assert result.exit_code == 0
+    (argv,) = ssh_calls
+    assert "ec2-user@10.0.0.1" in argv
+    assert argv[-1].endswith(" bash -c 'echo hi; id'")
+
+
+def test_exec_single_string_command(no_aws, ssh_calls):
+    result = CliRunner().invoke(
+        ecs.ecs, ["exec", "--instance-ip", "10.0.0.1", "web", "python manage.py shell"], input="y\n"
+    )
+
+    assert result.exit_code == 0
+    assert 'You are about to execute "python manage.py shell"' in result.output
+    (argv,) = ssh_calls
+    assert argv[-1].endswith(')" python manage.py shell')
+
+
+def test_exec_confirmation_shows_quoted_command(no_aws, ssh_calls):
+    result = CliRunner().invoke(
+        ecs.ecs,
+        ["exec", "--instance-ip", "10.0.0.1", "web", "--", "bash", "-c", "echo hi; id"],
+        input="n\n",
+    )
+
+    assert result.exit_code == 0
+    assert "You are about to execute \"bash -c 'echo hi; id'\"" in result.output
+    assert ssh_calls == []
+
+
+@pytest.mark.parametrize(
+    "persist_args, control_persist",
+    [([], "ControlPersist=60s"), (["--persist", "0"], "ControlPersist=no")],
+)
+def test_exec_persist(no_aws, ssh_calls, persist_args, control_persist):
+    result = CliRunner().invoke(
+        ecs.ecs, ["exec", "--instance-ip", "10.0.0.1", *persist_args, "-y", "web", "ls"]
+    )
+
+    assert result.exit_code == 0
+    (argv,) = ssh_calls
+    assert [o for o in argv if o.startswith("ControlPersist=")] == [control_persist]